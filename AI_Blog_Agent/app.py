@@ -1,22 +1,42 @@
 import streamlit as st
+import asyncio
+import csv
+import hashlib
+import importlib.util
+import io
+import json
+import logging
 import os
+import queue
+import re
 import sys
+import threading
+import time
+from concurrent.futures import Future, wait
 from datetime import datetime
+from types import SimpleNamespace
 
 # Add error handling for imports
 def check_and_install_packages():
     """Check if required packages are installed"""
     required_packages = {
         'crewai': 'crewai',
-        'crewai_tools': 'crewai-tools',
+        'httpx': 'httpx[http2]',
+        'h2': 'httpx[http2]',
+        'diskcache': 'diskcache',
+        'numpy': 'numpy',
+        'faiss': 'faiss-cpu',
+        'sentence_transformers': 'sentence-transformers',
     }
+    # Only needed when exact hits are shared through Redis
+    if os.getenv("BLOG_CACHE_REDIS_URL"):
+        required_packages['redis'] = 'redis'
     
-    missing_packages = []
-    for package, install_name in required_packages.items():
-        try:
-            __import__(package)
-        except ImportError:
-            missing_packages.append(install_name)
+    # find_spec locates packages without importing them, keeping startup fast
+    missing_packages = list(dict.fromkeys(
+        install_name for package, install_name in required_packages.items()
+        if importlib.util.find_spec(package) is None
+    ))
     
     if missing_packages:
         st.error(f"Missing required packages: {', '.join(missing_packages)}")
@@ -26,14 +46,719 @@ def check_and_install_packages():
 # Check packages first
 check_and_install_packages()
 
-# Now import the packages
-try:
+@st.cache_resource
+def _lazy_crewai():
+    """Import CrewAI on first use so the page renders without loading it"""
     from crewai import Agent, Task, Crew, Process, LLM
-    from crewai_tools import SerperDevTool
-except ImportError as e:
-    st.error(f"Import error: {str(e)}")
-    st.info("Try upgrading CrewAI: `pip install --upgrade crewai crewai-tools`")
-    st.stop()
+    from crewai.tools import BaseTool
+    from pydantic import BaseModel, Field
+    try:
+        from crewai.events import crewai_event_bus, LLMStreamChunkEvent
+    except ImportError:
+        from crewai.utilities.events import crewai_event_bus, LLMStreamChunkEvent
+    
+    class SerperSearchInput(BaseModel):
+        search_query: str = Field(..., description="The query to search the internet with")
+    
+    class CachedSerperTool(BaseTool):
+        """Serper web search over a shared HTTP/2 connection, reusing results for identical queries"""
+        
+        name: str = "Search the internet"
+        description: str = "Search the internet with Serper and return the top results for a query."
+        args_schema: type[BaseModel] = SerperSearchInput
+        api_key: str
+        n_results: int = 10
+        
+        def _run(self, search_query):
+            key = hashlib.sha256(f"{search_query}:{self.n_results}".encode()).hexdigest()
+            cache = get_serper_cache()
+            result = cache.get(key)
+            if result is None:
+                result = self._search(search_query)
+                cache.set(key, result, expire=SERPER_CACHE_TTL)
+            return result
+        
+        def _search(self, search_query):
+            # All researchers share one pooled client and a cap on in-flight requests
+            with get_serper_limiter():
+                response = get_serper_client().post(
+                    "/search",
+                    headers={"X-API-KEY": self.api_key},
+                    json={"q": search_query, "num": self.n_results}
+                )
+            response.raise_for_status()
+            
+            results = [
+                f"Title: {item.get('title')}\nLink: {item.get('link')}\nSnippet: {item.get('snippet')}\n---"
+                for item in response.json().get("organic", [])[:self.n_results]
+            ]
+            return "\n".join(results) or "No results found."
+    
+    return SimpleNamespace(
+        Agent=Agent,
+        Task=Task,
+        Crew=Crew,
+        Process=Process,
+        LLM=LLM,
+        CachedSerperTool=CachedSerperTool,
+        crewai_event_bus=crewai_event_bus,
+        LLMStreamChunkEvent=LLMStreamChunkEvent,
+    )
+
+# Agent/crew tracing is off unless explicitly enabled; it only adds overhead in the UI
+DEBUG = os.getenv("BLOG_AGENT_DEBUG") == "1"
+if not DEBUG:
+    logging.getLogger("crewai").setLevel(logging.WARNING)
+
+# Generated blogs are cached on disk, keyed both exactly and by topic embedding.
+# The cache survives restarts and is shared by every worker pointed at the same
+# directory; set BLOG_CACHE_REDIS_URL to share exact hits across machines too.
+BLOG_CACHE_DIR = os.getenv(
+    "BLOG_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "blogs")
+)
+BLOG_CACHE_REDIS_URL = os.getenv("BLOG_CACHE_REDIS_URL")
+BLOG_CACHE_TTL = 3600  # seconds
+# After the TTL an exact hit is still served for this long while a fresh copy is generated
+BLOG_STALE_WINDOW = 24 * 3600  # seconds
+# Stale blogs regenerated at once; more wait their turn instead of delaying user requests
+REFRESH_CONCURRENCY = 2
+# Crews run for users at once in this process; further requests queue for a worker
+GENERATION_CONCURRENCY = 4
+SIMILARITY_THRESHOLD = 0.95
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+SIMILARITY_SEARCH_K = 5  # neighbours checked, in case the closest one has expired
+
+# Filler words dropped from topics so equivalent phrasings share a cache key
+TOPIC_STOPWORDS = frozenset({
+    "a", "an", "the", "of", "in", "on", "for", "to", "and", "about", "with", "its"
+})
+
+# Serper results are reused across runs; blog research doesn't need fresher data
+SERPER_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "serper")
+SERPER_CACHE_TTL = 24 * 3600  # seconds
+
+# Max topics generated at once in batch mode, to stay within Clarifai/Serper rate limits
+BATCH_CONCURRENCY = 3
+
+# Serper requests in flight at once, across all researchers in this process
+SERPER_CONCURRENCY = 4
+
+@st.cache_resource
+def get_serper_client():
+    """Create one HTTP/2 client so every Serper search reuses the same connection"""
+    import httpx
+    return httpx.Client(
+        base_url="https://google.serper.dev",
+        http2=True,
+        timeout=30,
+        limits=httpx.Limits(max_keepalive_connections=SERPER_CONCURRENCY)
+    )
+
+@st.cache_resource
+def get_serper_limiter():
+    """Cap concurrent Serper requests to stay within its rate limits"""
+    return threading.BoundedSemaphore(SERPER_CONCURRENCY)
+
+@st.cache_resource
+def get_serper_cache():
+    """Open the on-disk cache of Serper search results"""
+    import diskcache
+    return diskcache.Cache(SERPER_CACHE_DIR)
+
+def create_clarifai_llm(model_name, api_key, stream=False):
+    """Create a Clarifai-hosted LLM"""
+    return _lazy_crewai().LLM(
+        model=f"clarifai/{model_name}",
+        api_key=api_key,
+        stream=stream
+    )
+
+@st.cache_resource
+def get_clarifai_llm(model_name, api_key):
+    """Create the non-streaming Clarifai LLM once and share it across reruns"""
+    return create_clarifai_llm(model_name, api_key)
+
+@st.cache_resource
+def get_search_tool(api_key):
+    """Create the cached Serper search tool once and share it across reruns"""
+    return _lazy_crewai().CachedSerperTool(api_key=api_key)
+
+# Research synthesis benefits from a stronger model, while turning finished
+# research into prose is a style task a small model handles well. Writing is
+# also the longest-output phase, so a cheaper writer saves the most latency and cost.
+CLARIFAI_MODELS = [
+    "meta/llama-3_1-8b-instruct",
+    "meta/llama-3_1-70b-instruct",
+    "mistralai/mistral-7b-instruct-v0_2",
+    "google/gemma-2b-it"
+]
+
+# Research facets, each handled by its own researcher so searches run in parallel
+RESEARCH_FOCUSES = [
+    ("Technology Research Analyst", "the underlying technology, recent technical developments and how it works"),
+    ("Business Research Analyst", "market trends, industry adoption, key companies and real-world use cases"),
+    ("Academic Research Analyst", "recent studies, expert opinions, statistics and open challenges"),
+]
+
+# Task prompts share one template per phase; {topic} is left for CrewAI to fill from the crew inputs
+RESEARCH_TEMPLATE = "Research and gather information about {{topic}}, focusing on {focus}. Focus on recent developments, key facts, and reliable sources."
+RESEARCH_DESCRIPTIONS = [RESEARCH_TEMPLATE.format(focus=focus) for _, focus in RESEARCH_FOCUSES]
+WRITING_TEMPLATE = "Write a well-structured blog post about {topic} using the research provided. Include an engaging title, introduction, main content sections, and conclusion."
+
+def create_researcher(role, focus, llm, tool):
+    """Create a researcher agent scoped to one facet of the topic"""
+    return _lazy_crewai().Agent(
+        role=role,
+        goal=f"Research {{topic}} with a focus on {focus}",
+        backstory=f"You are an expert research analyst specialising in {focus}. You stick to your area and cite reliable sources.",
+        tools=[tool],
+        llm=llm,
+        verbose=DEBUG,
+        allow_delegation=False
+    )
+
+def create_agents(llm, writer_llm, search_tool):
+    """Create the researcher agents and the writer agent"""
+    researchers = [
+        create_researcher(role, focus, llm, search_tool)
+        for role, focus in RESEARCH_FOCUSES
+    ]
+    
+    writer = _lazy_crewai().Agent(
+        role="Content Writer", 
+        goal="Write an engaging blog post about {topic}",
+        backstory="You are a skilled content writer who creates engaging and informative blog posts.",
+        llm=writer_llm,
+        verbose=DEBUG,
+        allow_delegation=False
+    )
+    
+    return researchers, writer
+
+def create_tasks(researchers, writer):
+    """Create one research task per researcher and the writing task that combines them"""
+    # No context between research tasks, so CrewAI runs them concurrently
+    Task = _lazy_crewai().Task
+    research_tasks = [
+        Task(
+            description=description,
+            expected_output="A detailed research summary with key findings and sources",
+            agent=researcher,
+            async_execution=True
+        )
+        for researcher, description in zip(researchers, RESEARCH_DESCRIPTIONS)
+    ]
+    
+    writing_task = Task(
+        description=WRITING_TEMPLATE,
+        expected_output="A complete blog post in markdown format with proper headings and structure",
+        agent=writer,
+        context=research_tasks
+    )
+    
+    return research_tasks, writing_task
+
+async def build_crew(researcher_model, writer_model, clarifai_pat, serper_key, task_callback=None, writer_llm=None):
+    """Assemble the parallel research -> writing crew around the cached LLMs and search tool"""
+    # LLM and search tool setup don't depend on each other, so overlap them;
+    # both are cached, so this only costs anything on the first run
+    llm, cached_writer_llm, search_tool = await asyncio.gather(
+        asyncio.to_thread(get_clarifai_llm, researcher_model, clarifai_pat),
+        asyncio.to_thread(get_clarifai_llm, writer_model, clarifai_pat),
+        asyncio.to_thread(get_search_tool, serper_key)
+    )
+    
+    # Agents are cheap but stateful: kickoff writes the topic into them, so
+    # every run gets its own instead of sharing cached ones across sessions
+    researchers, writer = create_agents(llm, writer_llm or cached_writer_llm, search_tool)
+    research_tasks, writing_task = create_tasks(researchers, writer)
+    
+    crewai = _lazy_crewai()
+    return crewai.Crew(
+        agents=[*researchers, writer],
+        tasks=[*research_tasks, writing_task],
+        process=crewai.Process.sequential,
+        verbose=DEBUG,
+        task_callback=task_callback
+    )
+
+def result_to_markdown(result):
+    """Extract the blog markdown from a crew result"""
+    # Handle different result types
+    if hasattr(result, 'raw'):
+        return result.raw
+    elif isinstance(result, str):
+        return result
+    return str(result)
+
+async def run_blog_generation(topic, researcher_model, writer_model, clarifai_pat, serper_key, task_callback=None, writer_llm=None):
+    """Run the crew for a topic and return the blog markdown"""
+    crew = await build_crew(researcher_model, writer_model, clarifai_pat, serper_key, task_callback, writer_llm)
+    
+    # {topic} placeholders in agents and tasks are filled from inputs
+    result = await crew.kickoff_async(inputs={"topic": topic})
+    return result_to_markdown(result)
+
+async def run_batch_generation(topics, researcher_model, writer_model, clarifai_pat, serper_key):
+    """Run the crew for several topics concurrently and return their blogs in order, or the exception a topic failed with"""
+    crew = await build_crew(researcher_model, writer_model, clarifai_pat, serper_key)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def run_topic(topic):
+        async with semaphore:
+            # kickoff_for_each_async works on a copy of the crew, so topics
+            # running at the same time don't overwrite each other's inputs
+            results = await crew.kickoff_for_each_async(inputs=[{"topic": topic}])
+        return result_to_markdown(results[0])
+    
+    # One topic failing mustn't throw away the blogs the others already paid for
+    return await asyncio.gather(*(run_topic(topic) for topic in topics), return_exceptions=True)
+
+@st.cache_resource
+def get_encoder():
+    """Load the sentence embedding model once and share it across reruns"""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+
+@st.cache_resource
+def get_blog_cache():
+    """Open the on-disk blog cache shared across reruns and sessions"""
+    import diskcache
+    return diskcache.Cache(BLOG_CACHE_DIR)
+
+class RedisBlogCache:
+    """Exact-match blog cache in Redis, for deployments spread over several machines"""
+    
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+    
+    def get(self, key):
+        value = self.client.get(f"blog:{key}")
+        return json.loads(value) if value is not None else None
+    
+    def set(self, key, entry, expire, tag=None):
+        self.client.setex(f"blog:{key}", expire, json.dumps(entry))
+
+@st.cache_resource
+def get_exact_cache():
+    """Pick the store for exact-match hits: Redis when configured, else the disk cache"""
+    if BLOG_CACHE_REDIS_URL:
+        return RedisBlogCache(BLOG_CACHE_REDIS_URL)
+    return get_blog_cache()
+
+def normalize_topic(topic):
+    """Lowercase a topic, collapse whitespace and strip stopwords"""
+    words = re.sub(r"\s+", " ", topic.strip().lower()).split(" ")
+    # Don't reduce an all-stopword topic to nothing
+    return " ".join(word for word in words if word not in TOPIC_STOPWORDS) or " ".join(words)
+
+def blog_cache_key(topic, model_key):
+    """Hash a (normalized topic, models) pair into an exact-match cache key"""
+    return hashlib.sha256(f"{model_key}:{normalize_topic(topic)}".encode()).hexdigest()
+
+class VectorStore:
+    """FAISS indexes of topic embeddings per model pair, persisted next to the blog cache"""
+    
+    def __init__(self, cache):
+        self.cache = cache
+        self.lock = threading.Lock()
+        # model_key -> (generation, entries, index)
+        self.vectors = {}
+    
+    @staticmethod
+    def _index_path(model_key):
+        name = hashlib.sha256(model_key.encode()).hexdigest()[:16]
+        return os.path.join(BLOG_CACHE_DIR, f"index-{name}.faiss")
+    
+    @staticmethod
+    def _build_index(entries):
+        import faiss
+        import numpy as np
+        
+        # Embeddings are normalized, so inner product is the cosine similarity
+        index = faiss.IndexHNSWFlat(EMBEDDING_DIM, 32, faiss.METRIC_INNER_PRODUCT)
+        if entries:
+            index.add(np.array([entry["embedding"] for entry in entries], dtype="float32"))
+        return index
+    
+    def _load(self, model_key):
+        # Every write bumps vectors_generation, so a saved index or an
+        # in-memory copy is only reused when its generation matches. The
+        # counter is checked on every lookup so blogs added by other workers
+        # become visible here without waiting for this worker to write
+        generation = self.cache.get(f"vectors_generation:{model_key}", 0)
+        loaded = self.vectors.get(model_key)
+        if loaded is None or loaded[0] != generation:
+            import faiss
+            
+            entries = self.cache.get(f"topic_vectors:{model_key}", [])
+            path = self._index_path(model_key)
+            index = None
+            if self.cache.get(f"index_generation:{model_key}") == generation and os.path.exists(path):
+                index = faiss.read_index(path)
+            # These reads aren't atomic with another worker's add(), so the file
+            # may already hold newer vectors than entries; rebuild rather than
+            # hand search() ids that point past the end of entries
+            if index is None or index.ntotal != len(entries):
+                index = self._build_index(entries)
+            self.vectors[model_key] = (generation, entries, index)
+        return self.vectors[model_key]
+    
+    def search(self, embedding, model_key):
+        """Return the blog keys of the nearest topics that are similar enough, closest first"""
+        import numpy as np
+        
+        with self.lock:
+            _, entries, index = self._load(model_key)
+            if not entries:
+                return []
+            scores, ids = index.search(
+                np.asarray(embedding, dtype="float32")[None, :],
+                min(SIMILARITY_SEARCH_K, len(entries))
+            )
+        
+        return [
+            entries[i]["key"] for score, i in zip(scores[0], ids[0])
+            if 0 <= i < len(entries) and score >= SIMILARITY_THRESHOLD
+        ]
+    
+    def add(self, embedding, model_key, key):
+        """Record a blog's topic embedding in the index and on disk"""
+        import faiss
+        import numpy as np
+        
+        # Only the exact cache key is stored; the blog itself is read from the exact cache
+        entry = {"key": key, "embedding": embedding, "cached_at": time.time()}
+        with self.lock, self.cache.transact():
+            generation = self.cache.get(f"vectors_generation:{model_key}", 0)
+            entries = self.cache.get(f"topic_vectors:{model_key}", []) + [entry]
+            
+            now = time.time()
+            fresh = [e for e in entries if now - e["cached_at"] < BLOG_CACHE_TTL]
+            loaded = self.vectors.get(model_key)
+            if len(fresh) < len(entries) // 2:
+                # Mostly expired: compact the list and rebuild the index
+                entries = fresh
+                index = self._build_index(entries)
+            elif loaded is not None and loaded[0] == generation:
+                index = loaded[2]
+                index.add(np.asarray(embedding, dtype="float32")[None, :])
+            else:
+                # Another process wrote since we loaded
+                index = self._build_index(entries)
+            
+            generation += 1
+            self.cache.set(f"topic_vectors:{model_key}", entries)
+            self.cache.set(f"vectors_generation:{model_key}", generation)
+            # Written to a temp file and swapped in, so readers never see a partial index
+            path = self._index_path(model_key)
+            faiss.write_index(index, f"{path}.{os.getpid()}.tmp")
+            os.replace(f"{path}.{os.getpid()}.tmp", path)
+            self.cache.set(f"index_generation:{model_key}", generation)
+            self.vectors[model_key] = (generation, entries, index)
+
+@st.cache_resource
+def get_vector_store():
+    """Create the in-memory vector store once and share it across reruns"""
+    return VectorStore(get_blog_cache())
+
+def find_similar_blog(embedding, model_key):
+    """Return a fresh cached blog whose topic embedding is close enough to this one"""
+    cache = get_exact_cache()
+    for key in get_vector_store().search(embedding, model_key):
+        content, stale = read_exact_blog(cache, key)
+        if content is not None and not stale:
+            return content
+    return None
+
+def store_blog(key, embedding, model_key, content):
+    """Save a generated blog under its exact key and its topic embedding"""
+    # Kept past the TTL so it can still be served stale while it is regenerated;
+    # tagged by model pair so one pair's blogs can be evicted with cache.evict(tag)
+    get_exact_cache().set(
+        key,
+        {"content": content, "cached_at": time.time()},
+        expire=BLOG_CACHE_TTL + BLOG_STALE_WINDOW,
+        tag=model_key
+    )
+    get_vector_store().add(embedding, model_key, key)
+
+def read_exact_blog(cache, key):
+    """Return (content, stale) for an exact cache entry, or (None, False) on a miss"""
+    entry = cache.get(key)
+    if entry is None:
+        return None, False
+    return entry["content"], time.time() - entry["cached_at"] >= BLOG_CACHE_TTL
+
+def lookup_blogs(topics, model_key):
+    """Look up cached blogs for several topics, returning (key, embedding, content or None, stale) for each"""
+    cache = get_exact_cache()
+    keys = [blog_cache_key(topic, model_key) for topic in topics]
+    entries = [read_exact_blog(cache, key) for key in keys]
+    contents = [content for content, _ in entries]
+    stale = [is_stale for _, is_stale in entries]
+    embeddings = [None] * len(topics)
+    
+    # Embed all exact-cache misses in one batch so the encoder works on a single matrix
+    misses = [i for i, content in enumerate(contents) if content is None]
+    if misses:
+        encoded = get_encoder().encode(
+            [normalize_topic(topics[i]) for i in misses],
+            batch_size=64,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        for i, embedding in zip(misses, encoded):
+            embeddings[i] = embedding
+            contents[i] = find_similar_blog(embedding, model_key)
+    
+    return list(zip(keys, embeddings, contents, stale))
+
+def lookup_blog(topic, model_key):
+    """Look up a cached blog for the topic, returning (key, embedding, content or None, stale)"""
+    return lookup_blogs([topic], model_key)[0]
+
+@st.cache_resource
+def get_stream_listeners():
+    """Register one event bus handler that forwards LLM chunks to listening queues"""
+    crewai = _lazy_crewai()
+    listeners = {}
+    
+    @crewai.crewai_event_bus.on(crewai.LLMStreamChunkEvent)
+    def forward_chunk(source, event):
+        events = listeners.get(id(source))
+        if events is not None:
+            events.put(("chunk", event.chunk))
+    
+    return listeners
+
+@st.cache_resource
+def get_generation_queue():
+    """Start the workers that run user-requested crews off the Streamlit script thread"""
+    jobs = queue.Queue()
+    
+    def work():
+        while True:
+            jobs.get()()
+    
+    # Daemon workers: an abandoned crew can't hold up server shutdown
+    for _ in range(GENERATION_CONCURRENCY):
+        threading.Thread(target=work, daemon=True).start()
+    return jobs
+
+@st.cache_resource
+def get_generating_runs():
+    """Track crews running for users by blog key, so a repeated request waits on the same run"""
+    return SimpleNamespace(futures={}, lock=threading.Lock())
+
+def run_in_background(fn):
+    """Queue fn on the generation workers and return a Future for its result"""
+    future = Future()
+    
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+    
+    get_generation_queue().put(run)
+    return future
+
+@st.cache_resource
+def get_refreshing_keys():
+    """Track blogs being regenerated in the background so each is refreshed only once"""
+    return SimpleNamespace(keys=set(), lock=threading.Lock())
+
+@st.cache_resource
+def get_refresh_queue():
+    """Start the workers that regenerate stale blogs, kept apart from user-facing runs"""
+    jobs = queue.Queue()
+    
+    def work():
+        while True:
+            job = jobs.get()
+            try:
+                job()
+            except Exception:
+                # Nobody waits on a refresh, so this is the only place its errors surface
+                logging.getLogger(__name__).exception("Background blog refresh failed")
+    
+    for _ in range(REFRESH_CONCURRENCY):
+        threading.Thread(target=work, daemon=True).start()
+    return jobs
+
+def refresh_blog(topic, key, researcher_model, writer_model, clarifai_pat, serper_key):
+    """Regenerate a stale blog in the background and store the fresh copy"""
+    refreshing = get_refreshing_keys()
+    with refreshing.lock:
+        if key in refreshing.keys:
+            return
+        refreshing.keys.add(key)
+    
+    def run():
+        try:
+            # No writer_llm is passed, so this uses the cached non-streaming
+            # writer and none of its tokens reach a foreground stream
+            content = asyncio.run(
+                run_blog_generation(topic, researcher_model, writer_model, clarifai_pat, serper_key)
+            )
+            embedding = get_encoder().encode(normalize_topic(topic), normalize_embeddings=True)
+            store_blog(key, embedding, f"{researcher_model}|{writer_model}", content)
+        finally:
+            with refreshing.lock:
+                refreshing.keys.discard(key)
+    
+    get_refresh_queue().put(run)
+
+def stream_blog(topic, researcher_model, writer_model, clarifai_pat, serper_key, result, on_progress=None, on_tick=None, on_miss=None):
+    """Yield the blog as the writer produces it; the final markdown is put in result["content"]"""
+    model_key = f"{researcher_model}|{writer_model}"
+    key, embedding, content, stale = lookup_blog(topic, model_key)
+    if content is not None:
+        if stale:
+            refresh_blog(topic, key, researcher_model, writer_model, clarifai_pat, serper_key)
+            if on_progress is not None:
+                on_progress("♻️ Served a cached blog; a fresh version is being generated in the background")
+        result["content"] = content
+        yield content
+        return
+    
+    if on_miss is not None:
+        on_miss()
+    
+    # Poll instead of blocking: Streamlit only acts on a rerun (e.g. the Cancel
+    # button) when the script calls into it, so on_tick touches the UI while idle
+    started = time.monotonic()
+    
+    # A run for this blog may still be going, e.g. after the user cancelled
+    # waiting for it; wait on that one rather than paying for a second crew
+    generating = get_generating_runs()
+    with generating.lock:
+        future = generating.futures.get(key)
+        if future is None:
+            # Writer tokens and finished-task progress both arrive on this queue
+            events = queue.Queue()
+            listeners = get_stream_listeners()
+            # A streaming writer LLM of this run's own, so chunks from other sessions'
+            # runs on the same model can't reach this queue
+            writer_llm = create_clarifai_llm(writer_model, clarifai_pat, stream=True)
+            listeners[id(writer_llm)] = events
+            
+            def on_task_done(output):
+                events.put(("progress", f"✅ {output.agent} finished"))
+            
+            def run():
+                try:
+                    content = asyncio.run(
+                        run_blog_generation(
+                            topic, researcher_model, writer_model, clarifai_pat, serper_key,
+                            task_callback=on_task_done, writer_llm=writer_llm
+                        )
+                    )
+                    # Cached here so the blog is kept even if the user stopped waiting for it
+                    store_blog(key, embedding, model_key, content)
+                    return content
+                finally:
+                    events.put(None)
+                    with generating.lock:
+                        generating.futures.pop(key, None)
+            
+            future = generating.futures[key] = run_in_background(run)
+        else:
+            events = None
+    
+    if events is None:
+        if on_progress is not None:
+            on_progress("⏳ This blog is already being generated; waiting for that run to finish")
+        while not wait([future], timeout=0.2).done:
+            if on_tick is not None:
+                on_tick(time.monotonic() - started)
+        result["content"] = future.result()
+        yield result["content"]
+        return
+    
+    try:
+        while True:
+            try:
+                event = events.get(timeout=0.2)
+            except queue.Empty:
+                if on_tick is not None:
+                    on_tick(time.monotonic() - started)
+                continue
+            if event is None:
+                break
+            kind, value = event
+            if kind == "chunk":
+                yield value
+            elif on_progress is not None:
+                on_progress(value)
+    finally:
+        listeners.pop(id(writer_llm), None)
+    
+    # Re-raises anything the crew raised
+    result["content"] = future.result()
+
+def get_blogs(topics, researcher_model, writer_model, clarifai_pat, serper_key):
+    """Return (contents, failures) for several topics, generating only the cache misses as one batch; failed topics are None in contents"""
+    model_key = f"{researcher_model}|{writer_model}"
+    lookups = lookup_blogs(topics, model_key)
+    misses = [i for i, (_, _, content, _) in enumerate(lookups) if content is None]
+    contents = [content for _, _, content, _ in lookups]
+    failures = {}
+    
+    for topic, (key, _, content, stale) in zip(topics, lookups):
+        if content is not None and stale:
+            refresh_blog(topic, key, researcher_model, writer_model, clarifai_pat, serper_key)
+    
+    if misses:
+        generated = asyncio.run(
+            run_batch_generation([topics[i] for i in misses], researcher_model, writer_model, clarifai_pat, serper_key)
+        )
+        for i, content in zip(misses, generated):
+            if isinstance(content, BaseException):
+                failures[topics[i]] = content
+                continue
+            key, embedding, _, _ = lookups[i]
+            store_blog(key, embedding, model_key, content)
+            contents[i] = content
+    
+    return contents, failures
+
+def parse_topics_csv(uploaded_file):
+    """Read blog topics from the first column of an uploaded CSV"""
+    # utf-8-sig drops the BOM Excel puts at the start of CSVs it saves
+    reader = csv.reader(io.StringIO(uploaded_file.getvalue().decode("utf-8-sig")))
+    topics = [row[0].strip() for row in reader if row and row[0].strip()]
+    # Skip a header row if there is one
+    if topics and topics[0].lower() == "topic":
+        topics = topics[1:]
+    # Drop duplicates but keep the upload order
+    return list(dict.fromkeys(topics))
+
+@st.fragment
+def render_model_settings():
+    """Model pickers; changing them only reruns this fragment, not the whole page"""
+    # Values are read back from session state, as fragment reruns don't return to main()
+    st.selectbox(
+        "Researcher Model",
+        options=CLARIFAI_MODELS,
+        index=CLARIFAI_MODELS.index("meta/llama-3_1-70b-instruct"),
+        help="Model used to research and synthesize sources",
+        key="researcher_model"
+    )
+    
+    st.selectbox(
+        "Writer Model",
+        options=CLARIFAI_MODELS,
+        index=CLARIFAI_MODELS.index("meta/llama-3_1-8b-instruct"),
+        help="Model used to write the blog from the research",
+        key="writer_model"
+    )
 
 def main():
     st.set_page_config(page_title="AI Blog Writer", page_icon="✍️")
@@ -70,16 +795,14 @@ def main():
     # Configuration
     with st.sidebar:
         st.header("⚙️ Configuration")
-        model_name = st.selectbox(
-            "Clarifai Model",
-            options=[
-                "meta/llama-3_1-8b-instruct",
-                "meta/llama-3_1-70b-instruct", 
-                "mistralai/mistral-7b-instruct-v0_2",
-                "google/gemma-2b-it"
-            ],
-            index=0,
-            help="Select the model to use"
+        render_model_settings()
+        researcher_model = st.session_state["researcher_model"]
+        writer_model = st.session_state["writer_model"]
+        
+        batch_file = st.file_uploader(
+            "Batch topics (CSV)",
+            type="csv",
+            help="One topic per row in the first column"
         )
         
         st.divider()
@@ -92,6 +815,11 @@ def main():
         help="Be specific for better results"
     )
     
+    # Clicking cancel reruns the script, which stops the stream below; the
+    # crew itself finishes in the background and its blog is still cached
+    if st.session_state.get("cancel_generation"):
+        st.info("⏹️ Stopped waiting. The blog keeps generating in the background; generate it again to pick it back up.")
+    
     # Generate button
     if st.button("🚀 Generate Blog", type="primary", disabled=not (topic and clarifai_pat and serper_key)):
         if not topic.strip():
@@ -106,99 +834,35 @@ def main():
         os.environ["CLARIFAI_PAT"] = clarifai_pat
         os.environ["SERPER_API_KEY"] = serper_key
         
+        status = st.status("🧠 Generating content...", expanded=True)
+        # Filled only on a cache miss, once there is a crew to wait for
+        cancel_slot = st.empty()
         try:
-            with st.status("🧠 Generating content...", expanded=True) as status:
-                st.write("1. Initializing LLM...")
-                
-                # Initialize LLM
-                try:
-                    llm = LLM(
-                        model=f"clarifai/{model_name}",
-                        api_key=clarifai_pat
-                    )
-                    st.write("✅ LLM initialized")
-                except Exception as e:
-                    st.error(f"LLM initialization failed: {str(e)}")
-                    st.stop()
-                
-                st.write("2. Setting up search tool...")
-                
-                # Initialize search tool
-                try:
-                    search_tool = SerperDevTool(api_key=serper_key)
-                    st.write("✅ Search tool ready")
-                except Exception as e:
-                    st.error(f"Search tool initialization failed: {str(e)}")
-                    st.stop()
-                
-                st.write("3. Creating agents...")
-                
-                # Create agents
-                researcher = Agent(
-                    role="Research Analyst",
-                    goal=f"Research comprehensive information about {topic}",
-                    backstory="You are an expert research analyst with deep knowledge across various domains.",
-                    tools=[search_tool],
-                    llm=llm,
-                    verbose=False,
-                    allow_delegation=False
-                )
-                
-                writer = Agent(
-                    role="Content Writer", 
-                    goal=f"Write an engaging blog post about {topic}",
-                    backstory="You are a skilled content writer who creates engaging and informative blog posts.",
-                    llm=llm,
-                    verbose=False,
-                    allow_delegation=False
-                )
-                
-                st.write("✅ Agents created")
-                st.write("4. Setting up tasks...")
-                
-                # Create tasks
-                research_task = Task(
-                    description=f"Research and gather comprehensive information about {topic}. Focus on recent developments, key facts, and reliable sources.",
-                    expected_output="A detailed research summary with key findings and sources",
-                    agent=researcher
-                )
-                
-                writing_task = Task(
-                    description=f"Write a well-structured blog post about {topic} using the research provided. Include an engaging title, introduction, main content sections, and conclusion.",
-                    expected_output="A complete blog post in markdown format with proper headings and structure",
-                    agent=writer,
-                    context=[research_task]
-                )
-                
-                st.write("✅ Tasks configured")
-                st.write("5. Running crew...")
-                
-                # Create and run crew
-                crew = Crew(
-                    agents=[researcher, writer],
-                    tasks=[research_task, writing_task],
-                    process=Process.sequential,
-                    verbose=False
-                )
-                
-                # Execute
-                result = crew.kickoff()
-                
-                status.update(label="✅ Blog generated successfully!", state="complete")
+            status.write("1. Checking cache for this or a similar topic...")
+            
+            def on_miss():
+                status.write("2. Researching in parallel, then streaming the blog below...")
+                cancel_slot.button("⏹️ Cancel", key="cancel_generation")
             
             # Display results
             st.markdown("---")
             st.subheader("Generated Blog Post")
             
-            # Handle different result types
-            if hasattr(result, 'raw'):
-                content = result.raw
-            elif isinstance(result, str):
-                content = result
-            else:
-                content = str(result)
+            # Stream the writer's draft, then swap in the final blog once the crew finishes
+            result = {}
+            placeholder = st.empty()
+            with placeholder.container():
+                st.write_stream(stream_blog(
+                    topic, researcher_model, writer_model, clarifai_pat, serper_key, result,
+                    on_progress=status.write,
+                    on_tick=lambda elapsed: status.update(label=f"🧠 Generating content... ({elapsed:.0f}s)"),
+                    on_miss=on_miss
+                ))
+            content = result["content"]
+            placeholder.markdown(content)
+            cancel_slot.empty()
             
-            st.markdown(content)
+            status.update(label="✅ Blog generated successfully!", state="complete", expanded=False)
             
             # Download option
             st.download_button(
@@ -209,7 +873,11 @@ def main():
             )
             
         except Exception as e:
+            status.update(label="❌ Blog generation failed", state="error")
+            cancel_slot.empty()
             st.error(f"Error occurred: {str(e)}")
+            if isinstance(e, ImportError) and (e.name or "").split(".")[0] == "crewai":
+                st.info("Try upgrading CrewAI: `pip install --upgrade crewai crewai-tools`")
             
             # Show detailed error for debugging
             with st.expander("🐛 Debug Information"):
@@ -225,6 +893,51 @@ Python Version: {sys.version}
                     st.write(f"CrewAI Version: {crewai.__version__}")
                 except:
                     st.write("CrewAI Version: Unknown")
+    
+    # Batch mode
+    if batch_file is not None:
+        try:
+            topics = parse_topics_csv(batch_file)
+        except (UnicodeDecodeError, csv.Error) as e:
+            st.error(f"Could not read {batch_file.name}: {str(e)}")
+            st.info("Save the topics as a UTF-8 encoded CSV and upload it again.")
+            return
+        
+        st.markdown("---")
+        st.subheader("Batch Generation")
+        st.caption(f"{len(topics)} topics loaded from {batch_file.name}")
+        
+        if st.button(f"🚀 Generate {len(topics)} Blogs", disabled=not (topics and clarifai_pat and serper_key)):
+            os.environ["CLARIFAI_PAT"] = clarifai_pat
+            os.environ["SERPER_API_KEY"] = serper_key
+            
+            try:
+                with st.status("🧠 Generating batch...", expanded=True) as status:
+                    st.write(f"Running up to {BATCH_CONCURRENCY} crews at a time...")
+                    contents, failures = get_blogs(topics, researcher_model, writer_model, clarifai_pat, serper_key)
+                    if failures:
+                        status.update(label=f"⚠️ {len(topics) - len(failures)} of {len(topics)} blogs generated", state="error")
+                    else:
+                        status.update(label=f"✅ {len(contents)} blogs generated!", state="complete")
+                
+                for batch_topic, error in failures.items():
+                    st.error(f"{batch_topic}: {str(error)}")
+                
+                for i, (batch_topic, content) in enumerate(zip(topics, contents)):
+                    if content is None:
+                        continue
+                    with st.expander(batch_topic):
+                        st.markdown(content)
+                        st.download_button(
+                            "📥 Download as Markdown",
+                            data=content,
+                            file_name=f"{batch_topic.replace(' ', '_')[:30]}_blog.md",
+                            mime="text/markdown",
+                            key=f"batch_download_{i}"
+                        )
+            
+            except Exception as e:
+                st.error(f"Error occurred: {str(e)}")
 
 if __name__ == "__main__":
     main()
@@ -6,51 +6,16 @@ import sys
 print(f"Python version: {sys.version}")
 print("="*50)
 
-# Test imports one by one
-print("Testing imports...")
+# Check installed packages via their metadata, without importing them
+print("Checking installed packages...")
 
-try:
-    import streamlit as st
-    print("✅ streamlit imported successfully")
-    print(f"   Streamlit version: {st.__version__}")
-except ImportError as e:
-    print(f"❌ streamlit import failed: {e}")
+from importlib.metadata import version, PackageNotFoundError
 
-try:
-    import crewai
-    print("✅ crewai imported successfully")
-    print(f"   CrewAI version: {crewai.__version__}")
-except ImportError as e:
-    print(f"❌ crewai import failed: {e}")
-
-try:
-    from crewai import Agent, Task, Crew, Process
-    print("✅ crewai core components imported successfully")
-except ImportError as e:
-    print(f"❌ crewai core components import failed: {e}")
-
-try:
-    from crewai import LLM
-    print("✅ crewai LLM imported successfully")
-except ImportError as e:
-    print(f"❌ crewai LLM import failed: {e}")
+for package in ("streamlit", "crewai", "crewai-tools", "langchain", "diskcache", "numpy", "faiss-cpu", "sentence-transformers"):
     try:
-        from langchain_community.llms import LLM
-        print("✅ LLM imported from langchain_community")
-    except ImportError as e2:
-        print(f"❌ LLM import from langchain_community also failed: {e2}")
-
-try:
-    import crewai_tools
-    print("✅ crewai_tools imported successfully")
-except ImportError as e:
-    print(f"❌ crewai_tools import failed: {e}")
-
-try:
-    from crewai_tools import SerperDevTool
-    print("✅ SerperDevTool imported successfully")
-except ImportError as e:
-    print(f"❌ SerperDevTool import failed: {e}")
+        print(f"✅ {package} {version(package)}")
+    except PackageNotFoundError:
+        print(f"❌ {package} is not installed")
 
 print("="*50)
 print("Environment variables check:")
@@ -74,19 +39,25 @@ print("Basic functionality test:")
 
 if clarifai_pat and serper_key:
     try:
+        from concurrent.futures import ThreadPoolExecutor
         from crewai import LLM
         from crewai_tools import SerperDevTool
         
-        print("Testing LLM initialization...")
-        llm = LLM(
-            model="meta/llama-3_1-8b-instruct",
-            api_key=clarifai_pat
-        )
-        print("✅ LLM initialization successful")
+        # Both checks are independent network-bound setups, so run them side by side
+        print("Testing LLM and SerperDevTool initialization...")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            f_llm = executor.submit(lambda: LLM(
+                model="meta/llama-3_1-8b-instruct",
+                api_key=clarifai_pat
+            ))
+            f_tool = executor.submit(lambda: SerperDevTool(api_key=serper_key))
         
-        print("Testing SerperDevTool initialization...")
-        search_tool = SerperDevTool(api_key=serper_key)
-        print("✅ SerperDevTool initialization successful")
+        for name, future in (("LLM", f_llm), ("SerperDevTool", f_tool)):
+            try:
+                future.result()
+                print(f"✅ {name} initialization successful")
+            except Exception as e:
+                print(f"❌ {name} initialization failed: {e}")
         
     except Exception as e:
         print(f"❌ Functionality test failed: {e}")